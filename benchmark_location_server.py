@@ -0,0 +1,105 @@
+import time
+import asyncio
+
+import click
+
+import httpx
+
+from location_server import app
+
+mock_gps_current = {
+    'mode': 2,
+    'lat': 12.345,
+    'lon': 67.890,
+    'speed': 50,
+    'track': 0,
+    'alt': 1000
+}
+
+
+async def poll(client, mode, stop, stats):
+    etag = None
+    version = None
+
+    while not stop.is_set():
+        headers = {}
+        params = {}
+
+        if mode != 'plain' and etag:
+            headers['If-None-Match'] = etag
+
+        if mode == 'long-poll' and version:
+            params = {'since': version, 'timeout': 1}
+
+        response = await client.get('/state', headers=headers, params=params)
+
+        stats['requests'] += 1
+        stats['bytes'] += len(response.content)
+
+        if response.status_code == 200:
+            etag = response.headers.get('etag')
+            version = response.headers.get('x-state-version')
+
+        # The in-process transport never suspends, so give the other
+        # pollers and the timer a turn.
+        await asyncio.sleep(0)
+
+
+async def update(client, interval, stop):
+    while not stop.is_set():
+        await client.put('/location', json=mock_gps_current)
+        await asyncio.sleep(interval)
+
+
+async def run(mode, pollers, duration, update_interval):
+    transport = httpx.ASGITransport(app=app)
+    stats = {'requests': 0, 'bytes': 0}
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url='http://localhost') as client:
+        await client.put('/location', json=mock_gps_current)
+
+        tasks = [asyncio.create_task(poll(client, mode, stop, stats))
+                 for _ in range(pollers)]
+
+        if update_interval:
+            tasks.append(asyncio.create_task(
+                update(client, update_interval, stop)))
+
+        start_cpu = time.process_time()
+
+        await asyncio.sleep(duration)
+        stop.set()
+
+        cpu = time.process_time() - start_cpu
+
+        await asyncio.gather(*tasks)
+
+    return stats, cpu
+
+
+@click.command(help="Benchmark /state polling with concurrent clients.")
+@click.option("--pollers", default=100, type=int,
+              help="Number of concurrent pollers.")
+@click.option("--duration", default=5.0, type=float,
+              help="Seconds to run each mode.")
+@click.option("--update-interval", default=1.0, type=float,
+              help="Seconds between location updates, 0 for none.")
+@click.option("--mode", "modes", multiple=True,
+              type=click.Choice(['plain', 'etag', 'long-poll']),
+              default=['plain', 'etag', 'long-poll'],
+              help="Polling strategy to benchmark.")
+def cli(pollers, duration, update_interval, modes):
+    for mode in modes:
+        stats, cpu = asyncio.run(run(mode, pollers, duration,
+                                     update_interval))
+
+        click.echo(f"{mode:>10}: "
+                   f"{stats['requests'] / duration:10.1f} requests/sec "
+                   f"{stats['bytes'] / duration:12.1f} bytes/sec "
+                   f"{cpu / duration:6.1%} CPU")
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,15 +1,52 @@
 import os
+import re
+import json
+import time
+import bisect
+import asyncio
+import threading
 import subprocess
 import logging.config
 
+from datetime import datetime
+
+from collections import deque
+
+from typing import List
+from typing import Tuple
 from typing import Optional
 
 from fastapi import FastAPI
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
 
 from pydantic import BaseModel
 
 import geocoder
 
+import orjson
+
+from inotify_simple import INotify
+from inotify_simple import flags
+
+DETECT_DATA_PATH = '/var/www/html/DetectData.txt'
+SNAPSHOT_PATH = 'location_server.snapshot.json'
+
+# Seconds a fix may be from a detection, and between the two fixes it is
+# interpolated across, before the position is no longer trusted.
+MAX_FIX_AGE = 5
+MAX_FIX_GAP = 10
+
+# A fix older than this when the server starts is restored as no fix, and
+# only the most recent fixes of the track are kept in the snapshot.
+SNAPSHOT_FIX_AGE = 60
+SNAPSHOT_TRACK_LENGTH = 10
+
+time_pattern = re.compile(r'time (\d{2}:\d{2}:\d{2}[apmAPM]{2})')
+date_pattern = re.compile(r'date (\d{4}/\d{2}/\d{2})')
+
 
 class Location(BaseModel):
     mode: int
@@ -28,45 +65,169 @@ class State(BaseModel):
     current_state: Optional[str] = None
 
 
+class Snapshot(BaseModel):
+    current_location: Optional[Location] = None
+    location_time: Optional[float] = None
+    counter: int = 0
+    current_state: Optional[str] = None
+    track: List[Tuple[float, Location]] = []
+
+
+class Detection(BaseModel):
+    timestamp: datetime
+    data: str
+    location: Optional[Location] = None
+
+
+class CachedPayload:
+    def __init__(self, key, build, live=None):
+        self.key = key
+        self.build = build
+        self.live = live
+
+        self.last_key = None
+        self.version = 0
+        self.body = None
+
+    def refresh(self):
+        key = self.key()
+
+        if self.body is None or key != self.last_key:
+            self.last_key = key
+            self.version += 1
+            self.body = orjson.dumps(jsonable_encoder(self.build()))
+
+        return self
+
+    def render(self):
+        if self.live is None:
+            return self.body
+
+        return self.body[:-1] + b',' + orjson.dumps(self.live())[1:]
+
+    @property
+    def tag(self):
+        return f"{app.boot_id}-{self.version}"
+
+    @property
+    def etag(self):
+        return f'"{self.tag}"'
+
+
 app = FastAPI()
 
 app.current_location = None
+app.location_time = None
 app.interval = 1
 app.interval_limit = 300
 app.counter = 0
 app.current_state = None
 
+app.track = deque(maxlen=600)
+app.detections = deque(maxlen=100)
+app.background_stop = threading.Event()
+
+app.snapshot_path = os.environ.get('LOCATION_SNAPSHOT_PATH', SNAPSHOT_PATH)
+app.snapshot_interval = 30
+app.snapshot_thread = None
+
+app.boot_id = format(time.time_ns(), 'x')
+app.state_waiters = set()
+
+app.location_payload = CachedPayload(
+    lambda: (app.current_location,),
+    lambda: app.current_location
+)
+# The counter ticks on every PUT /location, so it is kept out of the cached
+# body and version, and added to each response as it is sent.
+app.state_payload = CachedPayload(
+    lambda: (app.current_location,
+             app.interval,
+             app.interval_limit,
+             app.current_state),
+    lambda: jsonable_encoder(State(current_location=app.current_location,
+                                   interval=app.interval,
+                                   interval_limit=app.interval_limit,
+                                   counter=app.counter,
+                                   current_state=app.current_state),
+                             exclude={'counter'}),
+    lambda: {'counter': app.counter}
+)
+
 app.GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY', None)
 
 logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
 logger = logging.getLogger(__name__)
 
-try:
-    with open('/var/www/html/ReadState.txt') as file:
-        app.current_state = file.read()
-except Exception as e:
-    logger.error(f"Unable to read Sherlock state on startup: {e}")
+
+@app.on_event("startup")
+def load_state():
+    load_snapshot(app.snapshot_path)
+
+    try:
+        with open('/var/www/html/ReadState.txt') as file:
+            app.current_state = file.read()
+    except Exception as e:
+        logger.error(f"Unable to read Sherlock state on startup: {e}")
+
+
+@app.on_event("startup")
+def start_background_threads():
+    app.background_stop.clear()
+
+    threading.Thread(target=tail_detect_data,
+                     args=(DETECT_DATA_PATH, app.background_stop),
+                     daemon=True).start()
+
+    app.snapshot_thread = threading.Thread(target=run_snapshots,
+                                           args=(app.snapshot_path,
+                                                 app.background_stop,
+                                                 app.snapshot_interval),
+                                           daemon=True)
+    app.snapshot_thread.start()
+
+
+@app.on_event("shutdown")
+def stop_background_threads():
+    app.background_stop.set()
+
+    if app.snapshot_thread:
+        app.snapshot_thread.join()
+        app.snapshot_thread = None
+
+    save_snapshot(app.snapshot_path)
 
 
 @app.get("/location")
-async def location():
-    return app.current_location
+async def location(request: Request,
+                   since: Optional[str] = None,
+                   timeout: float = Query(30, gt=0, le=300)):
+    return await cached_response(request, app.location_payload,
+                                 since, timeout)
 
 
 @app.get("/state")
-async def state():
-    return State(
-        current_location=app.current_location,
-        interval=app.interval,
-        interval_limit=app.interval_limit,
-        counter=app.counter,
-        current_state=app.current_state
-    )
+async def state(request: Request,
+                since: Optional[str] = None,
+                timeout: float = Query(30, gt=0, le=300)):
+    return await cached_response(request, app.state_payload,
+                                 since, timeout)
+
+
+@app.get("/detections")
+async def detections():
+    return list(app.detections)
 
 
 @app.put("/location")
 async def create_location(location: Location):
     app.current_location = location
+    app.location_time = time.time()
+
+    if location.mode > 1:
+        app.track.append((app.location_time, location))
+
+    notify_state_changed()
 
     app.counter += app.interval
     if app.counter > app.interval_limit and location.mode > 1:
@@ -77,6 +238,61 @@ async def create_location(location: Location):
     return app.current_location
 
 
+async def cached_response(request, payload, since, timeout):
+    if since is not None:
+        await wait_for_change(payload, since, timeout)
+
+    payload.refresh()
+
+    headers = {
+        'ETag': payload.etag,
+        'X-State-Version': payload.tag
+    }
+
+    if payload.live is not None:
+        for name, value in payload.live().items():
+            headers[f"X-State-{name.title()}"] = str(value)
+
+    if request.headers.get('if-none-match') == payload.etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=payload.render(),
+                    media_type='application/json',
+                    headers=headers)
+
+
+async def wait_for_change(payload, since, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    # Accept either the X-State-Version or the ETag; anything from another
+    # boot never matches and so returns straight away.
+    since = since.strip('"')
+
+    while payload.refresh().tag == since:
+        remaining = deadline - loop.time()
+
+        if remaining <= 0:
+            return
+
+        changed = asyncio.Event()
+        app.state_waiters.add(changed)
+
+        try:
+            await asyncio.wait_for(changed.wait(), remaining)
+        except asyncio.TimeoutError:
+            return
+        finally:
+            app.state_waiters.discard(changed)
+
+
+def notify_state_changed():
+    for changed in app.state_waiters:
+        changed.set()
+
+    app.state_waiters.clear()
+
+
 def update_sherlock_state(location: Location):
     address = None
 
@@ -95,6 +311,8 @@ def update_sherlock_state(location: Location):
 def write_sherlock_state_and_refresh(address):
     app.current_state = address.state
 
+    notify_state_changed()
+
     try:
         with open('/var/www/html/ReadState.txt', 'w') as file:
             file.write(address.state)
@@ -109,3 +327,215 @@ def write_sherlock_state_and_refresh(address):
         logger.error(f"Could not refresh Sherlock window: {e}")
 
     return app.current_state
+
+
+def snapshot_state():
+    snapshot = Snapshot(current_location=app.current_location,
+                        location_time=app.location_time,
+                        counter=app.counter,
+                        current_state=app.current_state,
+                        track=list(app.track)[-SNAPSHOT_TRACK_LENGTH:])
+
+    return json.dumps(jsonable_encoder(snapshot))
+
+
+def save_snapshot(path, last=None):
+    payload = snapshot_state()
+
+    if payload == last:
+        return last
+
+    temp_path = f"{path}.tmp"
+
+    try:
+        with open(temp_path, 'w') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, path)
+
+        directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    except Exception as e:
+        logger.error(f"Could not write state snapshot: {e}")
+        return last
+
+    return payload
+
+
+def load_snapshot(path):
+    try:
+        with open(path) as file:
+            snapshot = Snapshot(**json.load(file))
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error(f"Unable to read state snapshot: {e}")
+        return False
+
+    cutoff = time.time() - SNAPSHOT_FIX_AGE
+    current_location = snapshot.current_location
+
+    # The car may have moved since this fix, so don't serve it as live.
+    if current_location and (snapshot.location_time is None or
+                             snapshot.location_time < cutoff):
+        current_location = Location(**{**jsonable_encoder(current_location),
+                                       'mode': 1})
+
+    app.current_location = current_location
+    app.location_time = snapshot.location_time
+    app.counter = snapshot.counter
+    app.current_state = snapshot.current_state
+
+    app.track.clear()
+    app.track.extend((fix_time, fix) for fix_time, fix in snapshot.track
+                     if fix_time >= cutoff)
+
+    return True
+
+
+def run_snapshots(path, stop, interval):
+    last = None
+
+    while not stop.wait(interval):
+        last = save_snapshot(path, last)
+
+
+def tail_detect_data(path, stop, timeout=1000):
+    directory, name = os.path.split(path)
+
+    try:
+        inotify = INotify()
+        inotify.add_watch(directory,
+                          flags.MODIFY | flags.CREATE | flags.MOVED_TO)
+    except Exception as e:
+        logger.error(f"Unable to watch Sherlock detection data: {e}")
+        return
+
+    file = None
+    partial = b''
+
+    try:
+        file = open(path, 'rb')
+
+        # Pick up what was logged before we started, the same 20 lines a
+        # report would have read from the file.
+        lines = deque(file, 20)
+
+        if lines and not lines[-1].endswith(b'\n'):
+            partial = lines.pop()
+
+        for line in lines:
+            if line.strip():
+                add_detection(line.decode(errors='replace'))
+    except FileNotFoundError:
+        pass
+
+    with inotify:
+        while not stop.is_set():
+            events = inotify.read(timeout=timeout)
+
+            if not any(event.name == name for event in events):
+                continue
+
+            try:
+                if file is None or \
+                   os.stat(path).st_ino != os.fstat(file.fileno()).st_ino:
+                    if file:
+                        file.close()
+
+                    file = open(path, 'rb')
+                    partial = b''
+                elif os.fstat(file.fileno()).st_size < file.tell():
+                    file.seek(0)
+                    partial = b''
+
+                partial += file.read()
+            except Exception as e:
+                logger.error(f"Could not read Sherlock detection data: {e}")
+                continue
+
+            *lines, partial = partial.split(b'\n')
+
+            for line in lines:
+                if line.strip():
+                    add_detection(line.decode(errors='replace') + '\n')
+
+    if file:
+        file.close()
+
+
+def add_detection(line):
+    date_match = date_pattern.search(line)
+    time_match = time_pattern.search(line)
+
+    if not (date_match and time_match):
+        return None
+
+    timestamp = datetime.strptime(f"{date_match.group(1)} "
+                                  f"{time_match.group(1)}",
+                                  "%Y/%m/%d %I:%M:%S%p")
+
+    detection = Detection(timestamp=timestamp,
+                          data=line,
+                          location=interpolate_location(
+                              timestamp.timestamp()))
+
+    app.detections.append(detection)
+
+    return detection
+
+
+def interpolate_location(when):
+    track = list(app.track)
+
+    if not track:
+        return None
+
+    if when >= track[-1][0]:
+        fix_time, fix = track[-1]
+        return fix if when - fix_time <= MAX_FIX_AGE else None
+
+    if when <= track[0][0]:
+        fix_time, fix = track[0]
+        return fix if fix_time - when <= MAX_FIX_AGE else None
+
+    index = bisect.bisect_left([fix_time for fix_time, _ in track], when)
+
+    start_time, start = track[index - 1]
+    end_time, end = track[index]
+
+    if end_time - start_time > MAX_FIX_GAP:
+        if when - start_time <= MAX_FIX_AGE:
+            return start
+
+        if end_time - when <= MAX_FIX_AGE:
+            return end
+
+        return None
+
+    fraction = (when - start_time) / (end_time - start_time)
+
+    def between(a, b):
+        if a is None or b is None:
+            return a if fraction < 0.5 else b
+
+        return a + (b - a) * fraction
+
+    track_heading = None
+
+    if start.track is not None and end.track is not None:
+        turn = (end.track - start.track + 180) % 360 - 180
+        track_heading = (start.track + turn * fraction) % 360
+
+    return Location(mode=min(start.mode, end.mode),
+                    alt=between(start.alt, end.alt),
+                    track=track_heading,
+                    speed=between(start.speed, end.speed),
+                    lat=between(start.lat, end.lat),
+                    lon=between(start.lon, end.lon))
@@ -14,6 +14,8 @@ import geocoder
 
 import requests
 
+import zstandard
+
 labels = {
     'PD': {
         'short_label': 'PD',
@@ -65,6 +67,9 @@ now_string = now.strftime("%d %B %Y - %I:%M:%S%p")
 
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY', None)
 
+EXPORT_CHECKPOINT = "sherlock_export.json"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 @click.group()
 def cli():
@@ -121,7 +126,14 @@ def send(to, sender, agency):
         contents.append(f"Found a {labels[agency]['long_label']} unit, but could not find location.")
         contents.append("I'll respond later with where this occured.")
 
-    lines = get_data_logs()
+    detections = get_detections()
+
+    if detections:
+        lines = [detection['data'] for detection in detections]
+        positions = [detection['location'] for detection in detections]
+    else:
+        lines = get_data_logs()
+        positions = None
 
     if len(lines) > 0:
         contents.append("<h2>Data Log:</h2>")
@@ -143,11 +155,53 @@ def send(to, sender, agency):
 
     click.echo("Writing data log...")
 
-    write_data_logs(agency, location, lines)
+    write_data_logs(agency, location, lines, positions)
 
     click.echo("Done.")
 
 
+@cli.command(help="Export new detections to a compressed snapshot.",
+             name="export")
+@click.option("--source", default="sherlock.jsonl", type=str,
+              help="Detection log to export.")
+@click.option("--output", default=None, type=str,
+              help="Snapshot file to write.")
+@click.option("--checkpoint", default=EXPORT_CHECKPOINT, type=str,
+              help="File recording how far the last export got.")
+def export(source, output, checkpoint):
+    click.echo("Exporting detections...")
+
+    if not output:
+        output = datetime.now().strftime("sherlock-%Y%m%d-%H%M%S.jsonl.zst")
+
+    count = export_data_logs(source, output, checkpoint)
+
+    if count > 0:
+        click.echo(f"Exported {count} detections to {output}.")
+    else:
+        click.echo("No new detections since last export.")
+
+
+@cli.command(help="Upload a detection snapshot to Sherlock HQ.",
+             name="upload")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--url", required=True, type=str, envvar="SHERLOCK_HQ_URL",
+              help="Sherlock HQ upload endpoint.")
+@click.option("--chunk-size", default=UPLOAD_CHUNK_SIZE,
+              type=click.IntRange(min=1),
+              help="Bytes sent per request.")
+def upload(path, url, chunk_size):
+    click.echo(f"Uploading {path}...")
+
+    try:
+        sent = upload_snapshot(path, url, chunk_size)
+    except Exception as e:
+        raise click.ClickException(
+            f"Error uploading snapshot, rerun to resume: {e}")
+
+    click.echo(f"Uploaded {sent} bytes.")
+
+
 def get_location():
     click.echo("Getting location...")
 
@@ -207,6 +261,28 @@ def get_address(current):
     return address
 
 
+def get_detections():
+    recent = []
+
+    try:
+        response = requests.get('http://localhost:8000/detections')
+
+        if not response.ok:
+            click.echo(f"Unable to get detections: {response.status_code}")
+            return None
+
+        for detection in response.json():
+            timestamp = datetime.fromisoformat(detection['timestamp'])
+
+            if abs(now - timestamp) <= timedelta(minutes=5):
+                recent.append(detection)
+    except Exception as e:
+        click.echo(f"Unable to get detections: {e}")
+        return None
+
+    return recent
+
+
 def get_data_logs():
     lines = []
 
@@ -229,18 +305,151 @@ def get_data_logs():
     return lines
 
 
-def write_data_logs(agency, location, lines):
+def write_data_logs(agency, location, lines, positions=None):
     with open("sherlock.jsonl", "a") as file:
-        for line in lines:
+        for index, line in enumerate(lines):
             frame = {
                 'agency': agency,
                 'location': location,
                 'data': line
             }
 
+            if positions:
+                frame['detection_location'] = positions[index]
+
             string = json.dumps(frame)
             file.write(string + "\n")
 
 
+def read_export_checkpoint(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_export_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, 'w') as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, path)
+
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def export_lines(log, offset, writer, complete=False):
+    count = 0
+
+    log.seek(offset)
+
+    for line in log:
+        offset += len(line)
+
+        if not line.endswith(b"\n"):
+            # A report may still be writing this line - take it next time.
+            if not complete:
+                offset -= len(line)
+                break
+
+            line += b"\n"
+
+        if line.strip():
+            writer.write(line)
+            count += 1
+
+    return count, offset
+
+
+def export_data_logs(source, output, checkpoint_path=EXPORT_CHECKPOINT):
+    checkpoint = read_export_checkpoint(checkpoint_path)
+
+    try:
+        log = open(source, 'rb')
+    except FileNotFoundError:
+        return 0
+
+    count = 0
+
+    with log, open(output, 'wb') as snapshot:
+        stat = os.fstat(log.fileno())
+        offset = checkpoint.get('offset', 0)
+
+        compressor = zstandard.ZstdCompressor()
+
+        with compressor.stream_writer(snapshot, closefd=False) as writer:
+            if checkpoint.get('inode') != stat.st_ino:
+                # logrotate moved the file we were reading to .1, so finish
+                # it before starting on the fresh one.
+                rotated = f"{source}.1"
+
+                if checkpoint and os.path.exists(rotated) and \
+                   os.stat(rotated).st_ino == checkpoint.get('inode'):
+                    with open(rotated, 'rb') as rotated_log:
+                        count, _ = export_lines(rotated_log, offset, writer,
+                                                complete=True)
+
+                offset = 0
+            elif offset > stat.st_size:
+                offset = 0
+
+            exported, offset = export_lines(log, offset, writer)
+            count += exported
+
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+
+    if count == 0:
+        os.remove(output)
+
+    write_export_checkpoint(checkpoint_path, {'inode': stat.st_ino,
+                                              'offset': offset})
+
+    return count
+
+
+def upload_snapshot(path, url, chunk_size=UPLOAD_CHUNK_SIZE):
+    if chunk_size < 1:
+        raise ValueError(f"Chunk size must be positive, got {chunk_size}")
+
+    target = f"{url.rstrip('/')}/{os.path.basename(path)}"
+    total = os.path.getsize(path)
+
+    response = requests.head(target)
+
+    if response.status_code == 200:
+        offset = int(response.headers.get('Upload-Offset', 0))
+    else:
+        offset = 0
+
+    with open(path, 'rb') as file:
+        file.seek(offset)
+
+        while offset < total:
+            chunk = file.read(chunk_size)
+            end = offset + len(chunk) - 1
+
+            response = requests.put(target,
+                                    data=chunk,
+                                    headers={
+                                        'Content-Range':
+                                            f"bytes {offset}-{end}/{total}"
+                                    })
+            response.raise_for_status()
+
+            offset += len(chunk)
+
+    return offset
+
+
 if __name__ == "__main__":
     cli()
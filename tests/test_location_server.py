@@ -1,12 +1,29 @@
+import os
+import time
+import asyncio
+import tempfile
+import threading
+
+from datetime import datetime
+
 from unittest import TestCase
 from unittest.mock import patch
 from unittest.mock import mock_open
 
+import httpx
+
 from fastapi.testclient import TestClient
 
 from location_server import app
 from location_server import Location
 from location_server import update_sherlock_state
+from location_server import add_detection
+from location_server import interpolate_location
+from location_server import tail_detect_data
+from location_server import save_snapshot
+from location_server import load_snapshot
+from location_server import SNAPSHOT_FIX_AGE
+from location_server import SNAPSHOT_TRACK_LENGTH
 
 mock_gps_current = {
     'mode': 2,
@@ -49,10 +66,13 @@ class TestLocationServer(TestCase):
         self.file_patcher.stop()
 
         app.current_location = None
+        app.location_time = None
         app.interval = 1
         app.interval_limit = 300
         app.counter = 0
         app.current_state = 'NY'
+        app.track.clear()
+        app.detections.clear()
 
     def test_location(self):
         response = self.client.get('/location').json()
@@ -68,6 +88,140 @@ class TestLocationServer(TestCase):
         self.assertEqual(response['mode'],
                          mock_gps_current['mode'])
 
+    def test_location_etag(self):
+        self.client.put('/location',
+                        json=mock_gps_current)
+
+        response = self.client.get('/location')
+        etag = response.headers['etag']
+
+        response = self.client.get('/location',
+                                   headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_state_etag_changes_with_state(self):
+        response = self.client.get('/state')
+        etag = response.headers['etag']
+        version = response.headers['x-state-version']
+
+        app.current_state = 'CT'
+
+        response = self.client.get('/state',
+                                   headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['current_state'], 'CT')
+        self.assertNotEqual(response.headers['etag'], etag)
+        self.assertNotEqual(response.headers['x-state-version'], version)
+
+    def test_state_etag_ignores_counter(self):
+        self.client.put('/location',
+                        json=mock_gps_current)
+
+        response = self.client.get('/state')
+        etag = response.headers['etag']
+
+        self.client.put('/location',
+                        json=mock_gps_current)
+
+        response = self.client.get('/state',
+                                   headers={'If-None-Match': etag})
+
+        self.assertEqual(app.counter, 2)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['x-state-counter'], '2')
+
+        response = self.client.get('/state')
+
+        self.assertEqual(response.headers['etag'], etag)
+        self.assertEqual(response.json()['counter'], 2)
+
+    def test_state_counter_without_fix(self):
+        for _ in range(10):
+            self.client.put('/location',
+                            json={'mode': 1, 'lat': 0, 'lon': 0})
+
+        response = self.client.get('/state').json()
+
+        self.assertEqual(response['counter'], 10)
+        self.assertEqual(response['interval_limit'], 300)
+        self.assertEqual(response['current_location']['mode'], 1)
+
+    def test_state_since_timeout(self):
+        response = self.client.get('/state')
+        version = response.headers['x-state-version']
+        etag = response.headers['etag']
+
+        start = time.perf_counter()
+        response = self.client.get('/state',
+                                   params={'since': version,
+                                           'timeout': 0.2},
+                                   headers={'If-None-Match': etag})
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual(response.status_code, 304)
+
+    def test_state_since_stale_version(self):
+        self.client.put('/location',
+                        json=mock_gps_current)
+
+        start = time.perf_counter()
+        response = self.client.get('/state', params={'since': '0'})
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(response.json()['counter'], 1)
+        self.assertEqual(response.headers['x-state-counter'], '1')
+
+    def test_state_since_other_boot(self):
+        response = self.client.get('/state')
+        version = response.headers['x-state-version'].split('-')[-1]
+
+        start = time.perf_counter()
+        response = self.client.get('/state',
+                                   params={'since': f"0-{version}",
+                                           'timeout': 5})
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(response.status_code, 200)
+
+    def test_state_since_etag(self):
+        response = self.client.get('/state')
+        etag = response.headers['etag']
+
+        start = time.perf_counter()
+        self.client.get('/state', params={'since': etag, 'timeout': 0.2})
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+    def test_state_long_poll(self):
+        async def long_poll():
+            transport = httpx.ASGITransport(app=app)
+
+            async with httpx.AsyncClient(transport=transport,
+                                         base_url='http://test') as client:
+                response = await client.get('/state')
+                version = response.headers['x-state-version']
+
+                poll = asyncio.create_task(
+                    client.get('/state', params={'since': version,
+                                                 'timeout': 5}))
+
+                await asyncio.sleep(0.1)
+                self.assertFalse(poll.done())
+
+                await client.put('/location', json=mock_gps_current)
+
+                return await asyncio.wait_for(poll, 1)
+
+        response = asyncio.run(long_poll())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['current_location']['mode'],
+                         mock_gps_current['mode'])
+        self.assertEqual(len(app.state_waiters), 0)
+
     @patch('location_server.update_sherlock_state')
     def test_interval_limit_exceeded(self, mock_update):
         mock_update.return_value = MockLocation()
@@ -145,3 +299,271 @@ class TestLocationServer(TestCase):
 
         result = update_sherlock_state(self.location)
         self.assertEqual(result, location)
+
+
+class TestDetectData(TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+        self.timestamp = datetime(2023, 10, 1, 14, 30, 15)
+        self.line = self.timestamp.strftime("Sample Data time %I:%M:%S%p "
+                                            "date %Y/%m/%d\n")
+
+    def tearDown(self):
+        app.track.clear()
+        app.detections.clear()
+
+    def add_fix(self, when, lat, lon, track=0):
+        app.track.append((when, Location(mode=3, lat=lat, lon=lon,
+                                         speed=10, alt=100, track=track)))
+
+    def test_add_detection(self):
+        when = self.timestamp.timestamp()
+
+        self.add_fix(when - 2, 40.0, -74.0)
+        self.add_fix(when + 2, 41.0, -73.0)
+
+        detection = add_detection(self.line)
+
+        self.assertEqual(detection.timestamp, self.timestamp)
+        self.assertAlmostEqual(detection.location.lat, 40.5)
+        self.assertAlmostEqual(detection.location.lon, -73.5)
+
+        response = self.client.get('/detections').json()
+
+        self.assertEqual(len(response), 1)
+        self.assertEqual(response[0]['data'], self.line)
+        self.assertAlmostEqual(response[0]['location']['lat'], 40.5)
+
+    def test_add_detection_without_timestamp(self):
+        self.assertIsNone(add_detection("Sample Data\n"))
+        self.assertEqual(len(app.detections), 0)
+
+    def test_add_detection_without_track(self):
+        detection = add_detection(self.line)
+
+        self.assertIsNone(detection.location)
+
+    def test_interpolate_location_outside_track(self):
+        self.add_fix(100, 40.0, -74.0)
+        self.add_fix(101, 41.0, -73.0)
+
+        self.assertEqual(interpolate_location(103).lat, 41.0)
+        self.assertEqual(interpolate_location(98).lat, 40.0)
+
+    def test_interpolate_location_stale(self):
+        self.add_fix(100, 40.0, -74.0)
+        self.add_fix(101, 41.0, -73.0)
+
+        self.assertIsNone(interpolate_location(200))
+        self.assertIsNone(interpolate_location(50))
+
+    def test_interpolate_location_large_gap(self):
+        self.add_fix(0, 40.0, -74.0)
+        self.add_fix(43200, 42.0, -71.0)
+
+        self.assertIsNone(interpolate_location(21600))
+        self.assertEqual(interpolate_location(3).lat, 40.0)
+        self.assertEqual(interpolate_location(43198).lat, 42.0)
+
+    def test_interpolate_location_heading_wraps(self):
+        self.add_fix(100, 40.0, -74.0, track=350)
+        self.add_fix(110, 41.0, -73.0, track=10)
+
+        self.assertAlmostEqual(interpolate_location(105).track, 0)
+
+    def test_put_location_records_track(self):
+        self.client.put('/location', json=mock_gps_current)
+        self.client.put('/location', json={'mode': 1})
+
+        self.assertEqual(len(app.track), 1)
+
+        app.current_location = None
+        app.counter = 0
+
+    def test_tail_detect_data(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "DetectData.txt")
+
+            with open(path, 'w') as file:
+                file.write(self.line)
+
+            stop = threading.Event()
+            tailer = threading.Thread(target=tail_detect_data,
+                                      args=(path, stop, 50))
+            tailer.start()
+
+            time.sleep(0.2)
+
+            with open(path, 'a') as file:
+                file.write("Sample Data ")
+                file.flush()
+                time.sleep(0.2)
+                file.write(self.line[len("Sample Data "):])
+                file.write("No timestamp\n")
+
+            deadline = time.time() + 5
+
+            while not app.detections and time.time() < deadline:
+                time.sleep(0.05)
+
+            stop.set()
+            tailer.join()
+
+        self.assertEqual([detection.data for detection in app.detections],
+                         [self.line, self.line])
+
+    def test_tail_detect_data_seeds_window(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "DetectData.txt")
+
+            with open(path, 'w') as file:
+                file.write("No timestamp\n")
+                file.write(self.line)
+                file.write("Sample Data ")
+
+            stop = threading.Event()
+            stop.set()
+
+            tail_detect_data(path, stop, 50)
+
+        self.assertEqual([detection.data for detection in app.detections],
+                         [self.line])
+
+
+class TestStateSnapshot(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "snapshot.json")
+
+        self.default_snapshot_path = app.snapshot_path
+        app.snapshot_path = self.path
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+        app.snapshot_path = self.default_snapshot_path
+        app.current_location = None
+        app.location_time = None
+        app.counter = 0
+        app.current_state = 'NY'
+        app.track.clear()
+        app.detections.clear()
+
+    def write_state(self, age=0):
+        app.location_time = time.time() - age
+        app.current_location = Location(**mock_gps_current)
+        app.counter = 42
+        app.current_state = 'CT'
+        app.track.append((app.location_time, app.current_location))
+
+        save_snapshot(self.path)
+
+        app.current_location = None
+        app.location_time = None
+        app.counter = 0
+        app.current_state = None
+        app.track.clear()
+
+    def test_save_and_load_snapshot(self):
+        self.write_state()
+
+        self.assertTrue(load_snapshot(self.path))
+
+        self.assertEqual(app.current_location.lat, mock_gps_current['lat'])
+        self.assertEqual(app.counter, 42)
+        self.assertEqual(app.current_state, 'CT')
+        self.assertEqual(app.current_location.mode, mock_gps_current['mode'])
+        self.assertEqual(len(app.track), 1)
+        self.assertEqual(app.track[0][1].lon, mock_gps_current['lon'])
+
+    def test_load_snapshot_stale_fix(self):
+        self.write_state(age=SNAPSHOT_FIX_AGE + 1)
+
+        self.assertTrue(load_snapshot(self.path))
+
+        self.assertEqual(app.current_location.mode, 1)
+        self.assertEqual(app.current_location.lat, mock_gps_current['lat'])
+        self.assertEqual(app.counter, 42)
+        self.assertEqual(len(app.track), 0)
+
+    def test_save_snapshot_track_tail(self):
+        for fix_time in range(SNAPSHOT_TRACK_LENGTH * 2):
+            app.track.append((time.time() + fix_time,
+                              Location(**mock_gps_current)))
+
+        save_snapshot(self.path)
+        app.track.clear()
+        load_snapshot(self.path)
+
+        self.assertEqual(len(app.track), SNAPSHOT_TRACK_LENGTH)
+
+    def test_load_snapshot_missing(self):
+        self.assertFalse(load_snapshot(self.path))
+        self.assertIsNone(app.current_location)
+
+    def test_load_snapshot_corrupt(self):
+        with open(self.path, 'w') as file:
+            file.write('{"current_loc')
+
+        self.assertFalse(load_snapshot(self.path))
+        self.assertIsNone(app.current_location)
+
+    def test_load_snapshot_bad_schema(self):
+        app.current_state = 'NY'
+
+        with open(self.path, 'w') as file:
+            file.write('{"current_location": {"lat": 1}, "counter": 42, '
+                       '"current_state": "CT", "track": []}')
+
+        self.assertFalse(load_snapshot(self.path))
+        self.assertIsNone(app.current_location)
+        self.assertEqual(app.counter, 0)
+        self.assertEqual(app.current_state, 'NY')
+
+        with TestClient(app) as client:
+            self.assertEqual(client.get('/location').status_code, 200)
+
+    def test_shutdown_waits_for_snapshot_thread(self):
+        with TestClient(app):
+            thread = app.snapshot_thread
+
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(app.snapshot_thread)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_save_snapshot_unchanged(self):
+        last = save_snapshot(self.path)
+        os.remove(self.path)
+
+        self.assertEqual(save_snapshot(self.path, last), last)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_save_snapshot_syncs_directory(self):
+        with patch('location_server.os.fsync') as mock_fsync:
+            save_snapshot(self.path)
+
+        self.assertEqual(mock_fsync.call_count, 2)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_save_snapshot_error(self):
+        path = os.path.join(self.path, "missing", "file.json")
+
+        self.assertIsNone(save_snapshot(path))
+
+    def test_time_to_first_valid_response(self):
+        self.write_state()
+
+        start = time.perf_counter()
+
+        with TestClient(app) as client:
+            location = client.get('/location').json()
+            state = client.get('/state').json()
+
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(location['lat'], mock_gps_current['lat'])
+        self.assertEqual(state['counter'], 42)
+        self.assertEqual(state['current_location']['mode'],
+                         mock_gps_current['mode'])
+        self.assertLess(elapsed, 0.5)
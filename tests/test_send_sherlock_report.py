@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from datetime import datetime
 
 import unittest
@@ -9,10 +12,19 @@ from send_sherlock_report import (
     get_location,
     get_gps_coordinates,
     get_address,
+    get_detections,
     get_data_logs,
-    write_data_logs
+    write_data_logs,
+    export_data_logs,
+    upload_snapshot
 )
 
+import zstandard
+
+from click.testing import CliRunner
+
+from send_sherlock_report import cli
+
 now = datetime.now()
 now_string = now.strftime("time %I:%M:%S%p date %Y/%m/%d")
 
@@ -41,6 +53,37 @@ class MockRequestNoFix:
         return mock_gps_current_no_fix
 
 
+class MockRequestDetections:
+    ok = True
+    status_code = 200
+
+    def json(self):
+        return [
+            {'timestamp': now.isoformat(),
+             'data': 'line1',
+             'location': mock_gps_current},
+            {'timestamp': '2020-01-01T00:00:00',
+             'data': 'line0',
+             'location': None}
+        ]
+
+
+class MockRequestDetectionsError:
+    ok = False
+    status_code = 404
+
+    def json(self):
+        return {'detail': 'Not Found'}
+
+
+class MockRequestDetectionsMalformed:
+    ok = True
+    status_code = 200
+
+    def json(self):
+        return {'detail': 'Not Found'}
+
+
 class MockLocation:
     def __init__(self):
         self.city = 'Sample City',
@@ -48,6 +91,42 @@ class MockLocation:
         self.county = 'Sample County'
 
 
+class MockResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class MockHQ:
+    def __init__(self, fail_after=None):
+        self.files = {}
+        self.puts = 0
+        self.fail_after = fail_after
+
+    def head(self, url):
+        if url not in self.files:
+            return MockResponse(404)
+
+        return MockResponse(200,
+                            {'Upload-Offset': str(len(self.files[url]))})
+
+    def put(self, url, data, headers):
+        if self.fail_after is not None and self.puts >= self.fail_after:
+            return MockResponse(503)
+
+        self.puts += 1
+
+        start = int(headers['Content-Range'].split()[1].split('-')[0])
+        received = self.files.setdefault(url, b'')
+        self.files[url] = received[:start] + data
+
+        return MockResponse(200)
+
+
 class TestSendSherlockReport(unittest.TestCase):
     @patch('send_sherlock_report.get_address')
     @patch('send_sherlock_report.get_gps_coordinates')
@@ -130,6 +209,34 @@ class TestSendSherlockReport(unittest.TestCase):
         address = get_address(mock_gps_current_no_fix)
         self.assertIsNone(address)
 
+    @patch('requests.get')
+    def test_get_detections(self, mock_request):
+        mock_request.return_value = MockRequestDetections()
+
+        detections = get_detections()
+        self.assertEqual(len(detections), 1)
+        self.assertEqual(detections[0]['data'], 'line1')
+        self.assertEqual(detections[0]['location']['lat'], 12.345)
+
+    @patch('requests.get')
+    def test_get_detections_server_error(self, mock_request):
+        mock_request.return_value = MockRequestDetectionsError()
+
+        self.assertIsNone(get_detections())
+
+    @patch('requests.get')
+    def test_get_detections_malformed(self, mock_request):
+        mock_request.return_value = MockRequestDetectionsMalformed()
+
+        self.assertIsNone(get_detections())
+
+    @patch('requests.get')
+    def test_get_detections_without_server(self, mock_request):
+        mock_request.side_effect = Exception("Whoopsie!")
+
+        detections = get_detections()
+        self.assertIsNone(detections)
+
     @patch('builtins.open', new_callable=unittest.mock.mock_open,
            read_data=f'Sample Data {now_string}\n')
     def test_get_data_logs(self, mock_open):
@@ -160,3 +267,169 @@ class TestSendSherlockReport(unittest.TestCase):
                           call(expected_json[1]),
                           call(expected_json[2])]
         mock_file().write.assert_has_calls(expected_calls, any_order=False)
+
+    @patch('builtins.open', new_callable=mock_open)
+    def test_write_data_logs_with_positions(self, mock_file):
+        write_data_logs("Agency", "Baker Street", ["line1"],
+                        [{'lat': 12.345, 'lon': 67.890}])
+
+        mock_file().write.assert_called_once_with(
+            '{"agency": "Agency", "location": "Baker Street", '
+            '"data": "line1", '
+            '"detection_location": {"lat": 12.345, "lon": 67.89}}\n')
+
+
+class TestExportSherlockData(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.source = os.path.join(self.directory.name, "sherlock.jsonl")
+        self.output = os.path.join(self.directory.name, "export.jsonl.zst")
+        self.checkpoint = os.path.join(self.directory.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_source(self, lines, mode="a"):
+        with open(self.source, mode) as file:
+            file.write(lines)
+
+    def read_output(self):
+        with open(self.output, 'rb') as file:
+            reader = zstandard.ZstdDecompressor().stream_reader(file)
+            return reader.read().decode()
+
+    def export(self):
+        return export_data_logs(self.source, self.output, self.checkpoint)
+
+    def test_export_data_logs(self):
+        self.write_source('{"data": "line1"}\n{"data": "line2"}\n')
+
+        count = self.export()
+
+        self.assertEqual(count, 2)
+        self.assertEqual(self.read_output(),
+                         '{"data": "line1"}\n{"data": "line2"}\n')
+
+    def test_export_data_logs_since_last_export(self):
+        self.write_source('{"data": "line1"}\n')
+        self.export()
+
+        self.write_source('{"data": "line2"}\n')
+        count = self.export()
+
+        self.assertEqual(count, 1)
+        self.assertEqual(self.read_output(), '{"data": "line2"}\n')
+
+    def test_export_data_logs_nothing_new(self):
+        self.write_source('{"data": "line1"}\n')
+        self.export()
+        os.remove(self.output)
+
+        count = self.export()
+
+        self.assertEqual(count, 0)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_export_data_logs_partial_line(self):
+        self.write_source('{"data": "line1"}\n{"data": "li')
+        self.assertEqual(self.export(), 1)
+
+        self.write_source('ne2"}\n')
+        self.assertEqual(self.export(), 1)
+        self.assertEqual(self.read_output(), '{"data": "line2"}\n')
+
+    def test_export_data_logs_after_rotation(self):
+        self.write_source('{"data": "line1"}\n{"data": "line2"}\n')
+        self.export()
+
+        os.remove(self.source)
+        self.write_source('{"data": "line3"}\n', mode="w")
+
+        self.assertEqual(self.export(), 1)
+        self.assertEqual(self.read_output(), '{"data": "line3"}\n')
+
+    def test_export_data_logs_finishes_rotated_file(self):
+        self.write_source('{"data": "line1"}\n')
+        self.export()
+
+        self.write_source('{"data": "line2"}\n')
+        os.rename(self.source, f"{self.source}.1")
+        self.write_source('{"data": "line3"}\n', mode="w")
+
+        self.assertEqual(self.export(), 2)
+        self.assertEqual(self.read_output(),
+                         '{"data": "line2"}\n{"data": "line3"}\n')
+
+        self.write_source('{"data": "line4"}\n')
+
+        self.assertEqual(self.export(), 1)
+        self.assertEqual(self.read_output(), '{"data": "line4"}\n')
+
+    def test_export_data_logs_missing_source(self):
+        self.assertEqual(self.export(), 0)
+        self.assertFalse(os.path.exists(self.output))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+class TestUploadSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.path = os.path.join(self.directory.name, "export.jsonl.zst")
+        self.payload = os.urandom(1000)
+
+        with open(self.path, 'wb') as file:
+            file.write(self.payload)
+
+        self.url = "http://hq.example.com/uploads"
+        self.target = f"{self.url}/export.jsonl.zst"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_upload_snapshot(self):
+        hq = MockHQ()
+
+        with patch('requests.head', hq.head), patch('requests.put', hq.put):
+            sent = upload_snapshot(self.path, self.url, chunk_size=300)
+
+        self.assertEqual(sent, 1000)
+        self.assertEqual(hq.puts, 4)
+        self.assertEqual(hq.files[self.target], self.payload)
+
+    def test_upload_snapshot_resumes(self):
+        hq = MockHQ(fail_after=2)
+
+        with patch('requests.head', hq.head), patch('requests.put', hq.put):
+            with self.assertRaises(Exception):
+                upload_snapshot(self.path, self.url, chunk_size=300)
+
+            self.assertEqual(len(hq.files[self.target]), 600)
+
+            hq.fail_after = None
+            upload_snapshot(self.path, self.url, chunk_size=300)
+
+        self.assertEqual(hq.puts, 4)
+        self.assertEqual(hq.files[self.target], self.payload)
+
+    def test_upload_snapshot_zero_chunk_size(self):
+        with self.assertRaises(ValueError):
+            upload_snapshot(self.path, self.url, chunk_size=0)
+
+    def test_upload_command_rejects_zero_chunk_size(self):
+        result = CliRunner().invoke(cli, ['upload', self.path,
+                                          '--url', self.url,
+                                          '--chunk-size', '0'])
+
+        self.assertEqual(result.exit_code, 2)
+
+    def test_upload_command_failure_exit_code(self):
+        hq = MockHQ(fail_after=0)
+
+        with patch('requests.head', hq.head), patch('requests.put', hq.put):
+            result = CliRunner().invoke(cli, ['upload', self.path,
+                                              '--url', self.url])
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("rerun to resume", result.output)